@@ -2,8 +2,12 @@
 app.py - FastAPI backend for CMDB Graph RAG
 Provides REST API endpoints for question answering
 """
+import os
+import json
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 from rag_chain import CMDBRagChain
@@ -13,11 +17,37 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Initialize RAG chain (singleton)
+rag_chain: Optional[CMDBRagChain] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize and warm up the RAG chain on startup, clean it up on shutdown"""
+    global rag_chain
+    try:
+        logger.info("Initializing RAG chain...")
+        rag_chain = CMDBRagChain()
+        await rag_chain.start()
+        logger.info("RAG chain initialized successfully")
+    except Exception as e:
+        logger.error(f"Failed to initialize RAG chain: {e}")
+        raise
+
+    yield
+
+    if rag_chain:
+        logger.info("Closing RAG chain...")
+        await rag_chain.close()
+        logger.info("RAG chain closed")
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="CMDB Graph RAG API",
     description="RAG-based question answering over CMDB knowledge graph",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -29,9 +59,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize RAG chain (singleton)
-rag_chain: Optional[CMDBRagChain] = None
-
 
 class QuestionRequest(BaseModel):
     """Request model for asking questions"""
@@ -54,29 +81,6 @@ class AnswerResponse(BaseModel):
     error: Optional[str] = None
 
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize RAG chain on startup"""
-    global rag_chain
-    try:
-        logger.info("Initializing RAG chain...")
-        rag_chain = CMDBRagChain()
-        logger.info("RAG chain initialized successfully")
-    except Exception as e:
-        logger.error(f"Failed to initialize RAG chain: {e}")
-        raise
-
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Clean up resources on shutdown"""
-    global rag_chain
-    if rag_chain:
-        logger.info("Closing RAG chain...")
-        rag_chain.close()
-        logger.info("RAG chain closed")
-
-
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -124,7 +128,7 @@ async def ask_question(request: QuestionRequest):
         logger.info(f"Processing question: {request.question}")
 
         # Get answer from RAG chain
-        result = rag_chain.answer(request.question)
+        result = await rag_chain.answer(request.question)
 
         logger.info(f"Answer generated successfully")
 
@@ -135,6 +139,41 @@ async def ask_question(request: QuestionRequest):
         raise HTTPException(status_code=500, detail=f"Error processing question: {str(e)}")
 
 
+@app.post("/ask/stream")
+async def ask_question_stream(request: QuestionRequest):
+    """
+    Ask a question and stream the answer as it is generated
+
+    Args:
+        request: Question request containing the user's question
+
+    Returns:
+        Newline-delimited JSON events: context (sources + graph data), token..., done
+    """
+    if not rag_chain:
+        raise HTTPException(status_code=503, detail="RAG chain not initialized")
+
+    if not request.question or not request.question.strip():
+        raise HTTPException(status_code=400, detail="Question cannot be empty")
+
+    logger.info(f"Streaming answer for question: {request.question}")
+
+    async def event_stream():
+        async for event in rag_chain.stream_answer(request.question):
+            yield json.dumps(event, default=str) + "\n"
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+
+@app.post("/cache/clear")
+async def clear_cache():
+    """Drop all cached answers"""
+    if not rag_chain:
+        raise HTTPException(status_code=503, detail="RAG chain not initialized")
+
+    return {"cleared": rag_chain.clear_cache()}
+
+
 @app.get("/examples")
 async def get_example_questions():
     """Get example questions to try"""
@@ -154,4 +193,11 @@ async def get_example_questions():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1"))
+    )
@@ -3,9 +3,15 @@ embed_nodes.py - Creates vector embeddings for all nodes in the graph
 Uses Google Gemini embeddings API and stores vectors in Neo4j
 """
 import os
+import argparse
+import hashlib
 import time
+from itertools import islice
+import numpy as np
 from neo4j import GraphDatabase
 import google.generativeai as genai
+from google.api_core.exceptions import ResourceExhausted
+from google.rpc import error_details_pb2
 
 # Connection settings
 NEO4J_URI = os.getenv("NEO4J_URI", "bolt://neo4j:7687")
@@ -18,113 +24,168 @@ if not GOOGLE_API_KEY:
 
 
 class NodeEmbedder:
-    def __init__(self, uri, user, password, google_api_key):
+    def __init__(self, uri, user, password, google_api_key, quantize=True):
         self.driver = GraphDatabase.driver(uri, auth=(user, password))
         genai.configure(api_key=google_api_key)
         self.embedding_model = "models/embedding-001"
         self.embedding_dimension = 768  # Gemini embedding-001 produces 768-dim vectors
+        self.batch_size = 100  # Descriptions sent per embed_content request
+        self.write_batch_size = 500  # Nodes updated per UNWIND write transaction
+        self.quantize = quantize  # int8-quantize vectors inside the index (disable with --fp32)
+        self.skipped_count = 0  # Unchanged nodes skipped by the last embedding run
 
     def close(self):
         self.driver.close()
 
     def create_vector_index(self):
-        """Create a vector index for similarity search"""
-        with self.driver.session() as session:
-            # Drop existing index if it exists
-            try:
-                session.run("DROP INDEX nodeEmbedIdx IF EXISTS")
-            except:
-                pass
+        """Create the vector index, keeping an existing one whose config already matches"""
+        index_config = {
+            "vector.dimensions": self.embedding_dimension,
+            "vector.similarity_function": "cosine",
+            "vector.quantization.enabled": self.quantize,
+        }
 
-            # Create new vector index
-            session.run(f"""
+        with self.driver.session() as session:
+            existing = session.run("""
+                SHOW INDEXES
+                YIELD name, options
+                WHERE name = 'nodeEmbedIdx'
+                RETURN options
+            """).single()
+
+            if existing is not None:
+                current = existing["options"]["indexConfig"]
+                if all(str(current.get(key)).lower() == str(value).lower() for key, value in index_config.items()):
+                    print("✓ Vector index already up to date")
+                    return
+                # Config changed (e.g. new model dimension) - rebuild the index
+                session.run("DROP INDEX nodeEmbedIdx").consume()
+
+            # Constant DDL text; the config travels as a parameter
+            session.run("""
                 CREATE VECTOR INDEX nodeEmbedIdx IF NOT EXISTS
                 FOR (n:Node)
                 ON n.embedding
-                OPTIONS {{
-                    indexConfig: {{
-                        `vector.dimensions`: {self.embedding_dimension},
-                        `vector.similarity_function`: 'cosine'
-                    }}
-                }}
-            """)
+                OPTIONS $options
+            """, options={"indexConfig": index_config}).consume()
             print("✓ Vector index created")
 
-    def get_node_description(self, node):
-        """Generate a text description from node properties"""
-        label = list(node.labels)[0] if node.labels else "Node"
-        props = dict(node)
+    def get_node_description(self, labels, props):
+        """Generate a text description from node labels and properties"""
+        # Pick the domain label deterministically so descriptions are stable across runs
+        labels = sorted(label for label in labels if label != "Node")
+        label = labels[0] if labels else "Node"
 
-        # Format properties as readable text
-        prop_parts = [f"{key}: {value}" for key, value in props.items() if key != 'embedding']
+        # Format properties as readable text (skip properties written by this script)
+        prop_parts = [f"{key}: {value}" for key, value in props.items()
+                      if key not in ('embedding', 'description', 'desc_sha1')]
         prop_text = ", ".join(prop_parts)
 
         return f"{label} - {prop_text}"
 
-    def get_embedding(self, text):
-        """Get embedding from Google Gemini with retry logic"""
+    def get_retry_delay(self, error):
+        """Extract the server's RetryInfo delay (in seconds) from a 429 error, if present"""
+        for detail in error.details or []:
+            if isinstance(detail, error_details_pb2.RetryInfo):
+                return detail.retry_delay.seconds + detail.retry_delay.nanos / 1e9
+        return None
+
+    def get_embeddings(self, texts):
+        """Get embeddings for a batch of texts from Google Gemini with retry logic"""
         max_retries = 3
-        retry_delay = 2  # seconds
+        retry_delay = 2  # seconds, used only when the server gives no RetryInfo
 
         for attempt in range(max_retries):
             try:
                 result = genai.embed_content(
                     model=self.embedding_model,
-                    content=text,
+                    content=texts,
                     task_type="retrieval_document"
                 )
-                return result['embedding']
-            except Exception as e:
-                if "429" in str(e) or "quota" in str(e).lower():
-                    if attempt < max_retries - 1:
-                        wait_time = retry_delay * (attempt + 1)
-                        print(f"  ⚠️  Rate limit hit, waiting {wait_time}s...")
-                        time.sleep(wait_time)
-                    else:
-                        raise
-                else:
+                # L2-normalize once at write time so cosine reduces to a dot product
+                embeddings = np.asarray(result['embedding'], dtype=np.float32)
+                embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12
+                return embeddings.tolist()
+            except ResourceExhausted as e:
+                if attempt == max_retries - 1:
                     raise
 
+                # Honor the server's reset window; fall back to exponential backoff
+                server_delay = self.get_retry_delay(e)
+                if server_delay is not None:
+                    wait_time = server_delay + 1
+                else:
+                    wait_time = retry_delay * (2 ** attempt)
+                print(f"  ⚠️  Rate limit hit, waiting {wait_time:.1f}s...")
+                time.sleep(wait_time)
+
+    def write_embeddings(self, session, rows):
+        """Store a batch of embeddings and descriptions in a single UNWIND write"""
+        # setNodeVectorProperty stores a compact float32 array instead of a list of doubles
+        session.execute_write(lambda tx: tx.run("""
+            UNWIND $rows AS row
+            MATCH (n)
+            WHERE elementId(n) = row.id
+            SET n.description = row.desc, n.desc_sha1 = row.sha1
+            WITH n, row
+            CALL db.create.setNodeVectorProperty(n, 'embedding', row.emb)
+        """, rows=rows).consume())
+
+    def iter_changed_nodes(self, session):
+        """Stream (nodeId, description, hash) for nodes whose description changed since last embedded"""
+        # Embeddings are projected out so existing vectors never come back over the wire
+        result = session.run("""
+            MATCH (n)
+            RETURN elementId(n) as nodeId, labels(n) as labels, n {.*, embedding: null} as props,
+                   n.desc_sha1 as oldHash, n.embedding IS NOT NULL as hasEmb
+        """)
+
+        self.skipped_count = 0
+        for record in result:
+            description = self.get_node_description(record["labels"], record["props"])
+            # Model and dimension are part of the hash so switching embedders forces a re-embed
+            desc_hash = hashlib.sha1(
+                f"{self.embedding_model}:{self.embedding_dimension}:{description}".encode()
+            ).hexdigest()
+            if record["hasEmb"] and record["oldHash"] == desc_hash:
+                self.skipped_count += 1
+                continue
+            yield record["nodeId"], description, desc_hash
+
     def embed_all_nodes(self):
         """Embed all nodes in the graph"""
         with self.driver.session() as session:
             # First, add Node label to all nodes for the index
-            session.run("MATCH (n) SET n:Node")
+            session.run("MATCH (n) SET n:Node").consume()
             print("✓ Added Node label to all nodes")
 
-            # Get all nodes
-            result = session.run("MATCH (n) RETURN n, id(n) as nodeId")
-            nodes = list(result)
-
-            print(f"\n📝 Embedding {len(nodes)} nodes...")
+        # Stream nodes on one session while writing batches on another
+        with self.driver.session() as read_session, self.driver.session() as write_session:
+            print("\n📝 Embedding new and changed nodes...")
 
             embedded_count = 0
-            for record in nodes:
-                node = record["n"]
-                node_id = record["nodeId"]
-
-                # Generate description
-                description = self.get_node_description(node)
-
-                # Get embedding with rate limiting
-                embedding = self.get_embedding(description)
-
-                # Store embedding back to node
-                session.run("""
-                    MATCH (n)
-                    WHERE id(n) = $nodeId
-                    SET n.embedding = $embedding
-                    SET n.description = $description
-                """, nodeId=node_id, embedding=embedding, description=description)
+            rows = []
+            pending = self.iter_changed_nodes(read_session)
+            while batch := list(islice(pending, self.batch_size)):
+                # One embed_content request per batch of descriptions
+                embeddings = self.get_embeddings([description for _, description, _ in batch])
+
+                rows.extend(
+                    {"id": node_id, "emb": embedding, "desc": description, "sha1": desc_hash}
+                    for (node_id, description, desc_hash), embedding in zip(batch, embeddings)
+                )
+                if len(rows) >= self.write_batch_size:
+                    self.write_embeddings(write_session, rows)
+                    rows = []
 
-                embedded_count += 1
-                if embedded_count % 5 == 0:
-                    print(f"  Embedded {embedded_count}/{len(nodes)} nodes...")
+                embedded_count += len(batch)
+                print(f"  Embedded {embedded_count} nodes...")
 
-                # Add delay to respect rate limits (Gemini free tier: ~2 requests/min)
-                if embedded_count < len(nodes):
-                    time.sleep(2)
+            if rows:
+                self.write_embeddings(write_session, rows)
 
+            if self.skipped_count:
+                print(f"  Skipped {self.skipped_count} unchanged nodes")
             print(f"✓ All {embedded_count} nodes embedded successfully")
 
     def verify_embeddings(self):
@@ -151,9 +212,14 @@ class NodeEmbedder:
 
 
 def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--fp32", action="store_true",
+                        help="Keep full-precision vectors in the index (no int8 quantization)")
+    args = parser.parse_args()
+
     print("🚀 Creating embeddings for all nodes...\n")
 
-    embedder = NodeEmbedder(NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD, GOOGLE_API_KEY)
+    embedder = NodeEmbedder(NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD, GOOGLE_API_KEY, quantize=not args.fp32)
 
     try:
         embedder.embed_all_nodes()
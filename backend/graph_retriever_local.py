@@ -3,8 +3,11 @@ graph_retriever_local.py - Retrieves relevant graph context using vector similar
 Uses local sentence-transformers instead of API calls
 """
 import os
-from typing import List, Dict, Any
-from neo4j import GraphDatabase
+import asyncio
+import threading
+from typing import List, Dict, Any, Tuple
+from neo4j import AsyncGraphDatabase
+from cachetools import LRUCache, cached
 from sentence_transformers import SentenceTransformer
 
 # Connection settings
@@ -12,149 +15,205 @@ NEO4J_URI = os.getenv("NEO4J_URI", "bolt://neo4j:7687")
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "password123")
 
+# Connection pool settings - size NEO4J_POOL to roughly workers x in-flight requests per worker.
+# retrieve() awaits the question embedding inside its read transaction, so each request holds a
+# pooled connection for the whole embedding call, not just the query
+NEO4J_POOL_SIZE = int(os.getenv("NEO4J_POOL", "50"))
+NEO4J_POOL_TIMEOUT = float(os.getenv("NEO4J_POOL_TIMEOUT", "30"))
+
 
 class GraphRetriever:
     def __init__(self, uri=NEO4J_URI, user=NEO4J_USER, password=NEO4J_PASSWORD):
-        self.driver = GraphDatabase.driver(uri, auth=(user, password))
+        self.driver = AsyncGraphDatabase.driver(
+            uri,
+            auth=(user, password),
+            max_connection_pool_size=NEO4J_POOL_SIZE,
+            connection_acquisition_timeout=NEO4J_POOL_TIMEOUT,
+            connection_timeout=5.0,
+            max_connection_lifetime=3600,
+            keep_alive=True
+        )
         self.model = SentenceTransformer('all-MiniLM-L6-v2')
-
-    def close(self):
-        self.driver.close()
+        # Cache keyed on the normalized question (the embedding model is pinned); the model still
+        # sees the original casing. Locked because embeddings are computed on worker threads
+        self._cached_embed = cached(
+            LRUCache(maxsize=1024), key=self._normalize_question, lock=threading.Lock()
+        )(self._raw_embed)
+
+    async def close(self):
+        await self.driver.close()
+
+    async def check_vector_index(self):
+        """Refuse to start without the vector index, so retrieval never falls back to a scan"""
+        async with self.driver.session() as session:
+            result = await session.run("""
+                SHOW VECTOR INDEXES
+                YIELD name, state
+                WHERE name = 'nodeEmbedIdx'
+                RETURN state
+            """)
+            record = await result.single()
+
+        if record is None:
+            raise RuntimeError(
+                "Vector index 'nodeEmbedIdx' not found - run the embedding script before starting the retriever"
+            )
+        if record["state"] != "ONLINE":
+            print(f"⚠️  Vector index 'nodeEmbedIdx' is {record['state']}, results may be incomplete")
 
     def get_embedding(self, text: str) -> List[float]:
+        """Get embedding for a question, served from the LRU cache when possible"""
+        return list(self._cached_embed(text.strip()))
+
+    @staticmethod
+    def _normalize_question(text: str) -> str:
+        """Cache key for a question: lowercased with whitespace collapsed"""
+        return " ".join(text.lower().split())
+
+    def _raw_embed(self, text: str) -> Tuple[float, ...]:
         """Get embedding using local model"""
-        embedding = self.model.encode(text, convert_to_numpy=True)
-        return embedding.tolist()
+        embedding = self.model.encode(text, convert_to_numpy=True, normalize_embeddings=True)
+        return tuple(embedding.tolist())
 
-    def retrieve(self, question: str, k: int = 5) -> Dict[str, Any]:
+    async def retrieve(self, question: str, k: int = 5, max_relationships: int = 50) -> Dict[str, Any]:
         """
         Retrieve relevant graph context for a question
 
         Args:
             question: User's question
             k: Number of similar nodes to retrieve
+            max_relationships: Cap on relationships returned by the 1-hop expansion
 
         Returns:
             Dictionary with nodes, relationships, and metadata
         """
-        # Get question embedding
-        question_embedding = self.get_embedding(question)
-
-        with self.driver.session() as session:
-            # Vector similarity search
-            result = session.run("""
-                CALL db.index.vector.queryNodes('nodeEmbedIdx', $k, $queryEmbedding)
-                YIELD node, score
-                RETURN node, score, id(node) as nodeId
-                ORDER BY score DESC
-            """, k=k, queryEmbedding=question_embedding)
-
-            similar_nodes = []
-            node_ids = []
-
-            for record in result:
-                node = record["node"]
-                score = record["score"]
-                node_id = record["nodeId"]
-
-                node_data = {
-                    "id": node_id,
-                    "labels": list(node.labels),
-                    "properties": dict(node),
-                    "score": score
-                }
-                # Remove embedding from properties (too large)
-                node_data["properties"].pop("embedding", None)
-
-                similar_nodes.append(node_data)
-                node_ids.append(node_id)
-
-            # Expand to 1-hop neighbors
-            if node_ids:
-                result = session.run("""
-                    MATCH (n)-[r]-(neighbor)
-                    WHERE id(n) IN $nodeIds
-                    RETURN
-                        id(n) as sourceId,
-                        id(neighbor) as targetId,
-                        type(r) as relType,
-                        properties(r) as relProps,
-                        neighbor,
-                        startNode(r) = n as outgoing
-                    LIMIT 50
-                """, nodeIds=node_ids)
-
-                relationships = []
-                neighbor_nodes = {}
-
-                for record in result:
-                    source_id = record["sourceId"]
-                    target_id = record["targetId"]
-                    rel_type = record["relType"]
-                    rel_props = record["relProps"]
-                    neighbor = record["neighbor"]
-                    is_outgoing = record["outgoing"]
-
-                    # Add relationship
-                    relationships.append({
-                        "source": source_id if is_outgoing else target_id,
-                        "target": target_id if is_outgoing else source_id,
-                        "type": rel_type,
-                        "properties": rel_props
-                    })
-
-                    # Add neighbor node if not already in similar_nodes
-                    if target_id not in node_ids and target_id not in neighbor_nodes:
-                        neighbor_data = {
-                            "id": target_id,
-                            "labels": list(neighbor.labels),
-                            "properties": dict(neighbor),
-                            "score": 0.0  # No score for neighbors
-                        }
-                        neighbor_data["properties"].pop("embedding", None)
-                        neighbor_nodes[target_id] = neighbor_data
-
-                # Combine similar nodes and neighbors
-                all_nodes = similar_nodes + list(neighbor_nodes.values())
-
-            else:
-                relationships = []
-                all_nodes = similar_nodes
+        # Start embedding the question off the event loop while a connection is acquired
+        embedding_task = asyncio.create_task(asyncio.to_thread(self.get_embedding, question))
+
+        try:
+            async with self.driver.session() as session:
+                # Vector similarity search + 1-hop expansion in a single round-trip
+                records = await session.execute_read(
+                    self._query_similar_with_neighbors, embedding_task, k, max_relationships
+                )
+        finally:
+            # If the session failed before awaiting the task, don't leave it (or its error) unretrieved
+            if not embedding_task.done():
+                embedding_task.cancel()
+            elif not embedding_task.cancelled():
+                embedding_task.exception()
+
+        similar_nodes = []
+        node_ids = set()
+
+        for record in records:
+            node_id = record["nodeId"]
+
+            # Embedding and desc_sha1 are nulled out in the projection; stored properties are never null
+            node_data = {
+                "id": node_id,
+                "labels": record["labels"],
+                "label_str": ":".join(record["labels"]),
+                "properties": {key: value for key, value in record["props"].items() if value is not None},
+                "score": record["score"]
+            }
+
+            similar_nodes.append(node_data)
+            node_ids.add(node_id)
+
+        relationships = []
+        neighbor_nodes = {}
+
+        for record in records:
+            source_id = record["nodeId"]
+
+            for hop in record["neighbors"]:
+                if len(relationships) >= max_relationships:
+                    break
+
+                target_id = hop["targetId"]
+                is_outgoing = hop["outgoing"]
+
+                # Add relationship
+                relationships.append({
+                    "source": source_id if is_outgoing else target_id,
+                    "target": target_id if is_outgoing else source_id,
+                    "type": hop["relType"]
+                })
+
+                # Add neighbor node if not already in similar_nodes
+                if target_id not in node_ids and target_id not in neighbor_nodes:
+                    neighbor_data = {
+                        "id": target_id,
+                        "labels": hop["labels"],
+                        "label_str": ":".join(hop["labels"]),
+                        "properties": {key: value for key, value in hop["props"].items() if value is not None},
+                        "score": 0.0  # No score for neighbors
+                    }
+                    neighbor_nodes[target_id] = neighbor_data
+
+        # Combine similar nodes and neighbors
+        all_nodes = similar_nodes + list(neighbor_nodes.values())
 
         return {
             "nodes": all_nodes,
             "relationships": relationships,
             "question": question,
             "num_similar": len(similar_nodes),
-            "num_neighbors": len(neighbor_nodes) if node_ids else 0
+            "num_neighbors": len(neighbor_nodes)
         }
 
+    @staticmethod
+    async def _query_similar_with_neighbors(tx, embedding_task, k, max_relationships):
+        """Run the vector search and collect each hit's 1-hop neighborhood"""
+        question_embedding = await embedding_task
+        result = await tx.run("""
+            CALL db.index.vector.queryNodes('nodeEmbedIdx', $k, $queryEmbedding)
+            YIELD node, score
+            RETURN
+                node {.*, embedding: null, desc_sha1: null} as props,
+                labels(node) as labels,
+                score,
+                elementId(node) as nodeId,
+                [(node)-[r]-(neighbor) | {
+                    targetId: elementId(neighbor),
+                    relType: type(r),
+                    props: neighbor {.*, embedding: null, desc_sha1: null},
+                    labels: labels(neighbor),
+                    outgoing: startNode(r) = node
+                }][..$maxRelationships] as neighbors
+            ORDER BY score DESC
+        """, k=k, queryEmbedding=question_embedding, maxRelationships=max_relationships)
+        return [record async for record in result]
+
     def format_context(self, retrieval_result: Dict[str, Any]) -> str:
         """Format retrieval result as text context for LLM"""
         nodes = retrieval_result["nodes"]
         relationships = retrieval_result["relationships"]
 
+        nodes_by_id = {node["id"]: node for node in nodes}
+
         context_parts = ["# Graph Context\n"]
 
         # Add nodes
         context_parts.append("## Nodes:")
         for node in nodes:
-            labels = ":".join(node["labels"])
+            labels = node["label_str"]
             props = node["properties"]
             # Get name or first non-embedding property
             name = props.get("name", props.get(list(props.keys())[0] if props else "unknown"))
             context_parts.append(f"- [{labels}] {name}")
             # Add key properties
             for key, value in props.items():
-                if key not in ["name", "embedding", "description"]:
+                if key not in ["name", "embedding", "description", "desc_sha1"]:
                     context_parts.append(f"  • {key}: {value}")
 
         # Add relationships
         if relationships:
             context_parts.append("\n## Relationships:")
             for rel in relationships:
-                source_node = next((n for n in nodes if n["id"] == rel["source"]), None)
-                target_node = next((n for n in nodes if n["id"] == rel["target"]), None)
+                source_node = nodes_by_id.get(rel["source"])
+                target_node = nodes_by_id.get(rel["target"])
 
                 if source_node and target_node:
                     source_name = source_node["properties"].get("name", "Node")
@@ -164,13 +223,15 @@ class GraphRetriever:
         return "\n".join(context_parts)
 
 
-def test_retriever():
+async def test_retriever():
     """Test the retriever with sample questions"""
     print("🔍 Testing Graph Retriever (Local Embeddings)\n")
 
     retriever = GraphRetriever()
 
     try:
+        await retriever.check_vector_index()
+
         test_questions = [
             "Where is the DB-Server located?",
             "What assets will break if Web-API goes down?",
@@ -179,7 +240,7 @@ def test_retriever():
 
         for question in test_questions:
             print(f"\n❓ Question: {question}")
-            result = retriever.retrieve(question, k=3)
+            result = await retriever.retrieve(question, k=3)
             print(f"   Found {result['num_similar']} similar nodes, {result['num_neighbors']} neighbors")
 
             context = retriever.format_context(result)
@@ -187,8 +248,8 @@ def test_retriever():
             print("-" * 80)
 
     finally:
-        retriever.close()
+        await retriever.close()
 
 
 if __name__ == "__main__":
-    test_retriever()
+    asyncio.run(test_retriever())
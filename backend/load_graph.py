@@ -3,80 +3,124 @@ load_graph.py - Creates a sample CMDB graph in Neo4j
 Hard-codes a small graph of Assets, Services, Users, and Locations
 """
 import os
-from neo4j import GraphDatabase
+import csv
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from neo4j import GraphDatabase, RoutingControl
 
 # Connection settings
 NEO4J_URI = os.getenv("NEO4J_URI", "bolt://neo4j:7687")
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "password123")
 
+# Connection pool settings (shared with the retriever's environment variables)
+NEO4J_POOL_SIZE = int(os.getenv("NEO4J_POOL", "50"))
+NEO4J_POOL_TIMEOUT = float(os.getenv("NEO4J_POOL_TIMEOUT", "30"))
+
+# Directory shared with Neo4j's import directory, for the --csv bulk-load path
+NEO4J_IMPORT_DIR = os.getenv("NEO4J_IMPORT_DIR", "/import")
+
+# Sample nodes by label, merged on name
+SAMPLE_NODES = {
+    "Location": [
+        {"name": "Data-Center-1", "region": "US-East", "city": "Virginia"},
+        {"name": "Data-Center-2", "region": "US-West", "city": "Oregon"},
+        {"name": "HQ-Office", "region": "US-East", "city": "New York"},
+    ],
+    "Asset": [
+        {"name": "DB-Server", "type": "Database", "os": "Linux", "status": "Running"},
+        {"name": "Web-Server-1", "type": "Web Server", "os": "Linux", "status": "Running"},
+        {"name": "Web-Server-2", "type": "Web Server", "os": "Linux", "status": "Running"},
+        {"name": "Load-Balancer", "type": "Network", "os": "Linux", "status": "Running"},
+        {"name": "Redis-Cache", "type": "Cache", "os": "Linux", "status": "Running"},
+        {"name": "Web-API", "type": "API Server", "os": "Linux", "status": "Running"},
+        {"name": "Backup-Server", "type": "Storage", "os": "Linux", "status": "Running"},
+    ],
+    "Service": [
+        {"name": "Payroll-Service", "criticality": "High", "sla": "99.9%"},
+        {"name": "Email-Service", "criticality": "Medium", "sla": "99.5%"},
+        {"name": "Employee-Portal", "criticality": "High", "sla": "99.9%"},
+    ],
+    "User": [
+        {"name": "John Smith", "role": "DevOps Engineer", "email": "john@company.com"},
+        {"name": "Sarah Johnson", "role": "Product Owner", "email": "sarah@company.com"},
+        {"name": "Mike Davis", "role": "System Admin", "email": "mike@company.com"},
+    ],
+}
+
 
 class GraphLoader:
     def __init__(self, uri, user, password):
-        self.driver = GraphDatabase.driver(uri, auth=(user, password))
+        self.driver = GraphDatabase.driver(
+            uri,
+            auth=(user, password),
+            max_connection_pool_size=NEO4J_POOL_SIZE,
+            connection_acquisition_timeout=NEO4J_POOL_TIMEOUT,
+            max_connection_lifetime=3600,
+            keep_alive=True
+        )
+        # Shared session for the sequential steps of the load
+        self.session = self.driver.session()
 
     def close(self):
+        self.session.close()
         self.driver.close()
 
     def clear_database(self):
         """Clear all nodes and relationships"""
-        with self.driver.session() as session:
-            session.run("MATCH (n) DETACH DELETE n")
-            print("✓ Database cleared")
+        self.driver.execute_query("MATCH (n) DETACH DELETE n", routing_=RoutingControl.WRITE)
+        print("✓ Database cleared")
 
     def create_constraints(self):
         """Create uniqueness constraints"""
-        with self.driver.session() as session:
-            constraints = [
-                "CREATE CONSTRAINT IF NOT EXISTS FOR (a:Asset) REQUIRE a.name IS UNIQUE",
-                "CREATE CONSTRAINT IF NOT EXISTS FOR (s:Service) REQUIRE s.name IS UNIQUE",
-                "CREATE CONSTRAINT IF NOT EXISTS FOR (u:User) REQUIRE u.name IS UNIQUE",
-                "CREATE CONSTRAINT IF NOT EXISTS FOR (l:Location) REQUIRE l.name IS UNIQUE",
-            ]
-            for constraint in constraints:
-                session.run(constraint)
-            print("✓ Constraints created")
+        constraints = [
+            "CREATE CONSTRAINT IF NOT EXISTS FOR (a:Asset) REQUIRE a.name IS UNIQUE",
+            "CREATE CONSTRAINT IF NOT EXISTS FOR (s:Service) REQUIRE s.name IS UNIQUE",
+            "CREATE CONSTRAINT IF NOT EXISTS FOR (u:User) REQUIRE u.name IS UNIQUE",
+            "CREATE CONSTRAINT IF NOT EXISTS FOR (l:Location) REQUIRE l.name IS UNIQUE",
+        ]
+        # Idempotent schema changes; execute_query handles session and retries per statement
+        for constraint in constraints:
+            self.driver.execute_query(constraint, routing_=RoutingControl.WRITE)
+        print("✓ Constraints created")
 
     def load_sample_data(self):
-        """Load sample CMDB data"""
-        with self.driver.session() as session:
-            # Create Locations
-            session.run("""
-                MERGE (dc1:Location {name: 'Data-Center-1', region: 'US-East', city: 'Virginia'})
-                MERGE (dc2:Location {name: 'Data-Center-2', region: 'US-West', city: 'Oregon'})
-                MERGE (office:Location {name: 'HQ-Office', region: 'US-East', city: 'New York'})
-            """)
-            print("✓ Locations created")
-
-            # Create Assets
-            session.run("""
-                MERGE (db:Asset {name: 'DB-Server', type: 'Database', os: 'Linux', status: 'Running'})
-                MERGE (web1:Asset {name: 'Web-Server-1', type: 'Web Server', os: 'Linux', status: 'Running'})
-                MERGE (web2:Asset {name: 'Web-Server-2', type: 'Web Server', os: 'Linux', status: 'Running'})
-                MERGE (lb:Asset {name: 'Load-Balancer', type: 'Network', os: 'Linux', status: 'Running'})
-                MERGE (cache:Asset {name: 'Redis-Cache', type: 'Cache', os: 'Linux', status: 'Running'})
-                MERGE (api:Asset {name: 'Web-API', type: 'API Server', os: 'Linux', status: 'Running'})
-                MERGE (backup:Asset {name: 'Backup-Server', type: 'Storage', os: 'Linux', status: 'Running'})
-            """)
-            print("✓ Assets created")
-
-            # Create Services
-            session.run("""
-                MERGE (payroll:Service {name: 'Payroll-Service', criticality: 'High', sla: '99.9%'})
-                MERGE (email:Service {name: 'Email-Service', criticality: 'Medium', sla: '99.5%'})
-                MERGE (portal:Service {name: 'Employee-Portal', criticality: 'High', sla: '99.9%'})
-            """)
-            print("✓ Services created")
-
-            # Create Users
-            session.run("""
-                MERGE (john:User {name: 'John Smith', role: 'DevOps Engineer', email: 'john@company.com'})
-                MERGE (sarah:User {name: 'Sarah Johnson', role: 'Product Owner', email: 'sarah@company.com'})
-                MERGE (mike:User {name: 'Mike Davis', role: 'System Admin', email: 'mike@company.com'})
-            """)
-            print("✓ Users created")
-
-            # Create relationships - Location (run each separately)
+        """Load sample CMDB data: node kinds in parallel, then all relationships"""
+        # Node kinds are independent of each other, so each is written on its own session/thread
+        with ThreadPoolExecutor(max_workers=len(SAMPLE_NODES)) as executor:
+            for label in executor.map(lambda item: self._insert_nodes(*item), SAMPLE_NODES.items()):
+                print(f"✓ {label} nodes created")
+
+        self.create_relationships()
+
+    def bulk_load_csv(self, import_dir):
+        """Load sample CMDB data with LOAD CSV from files in Neo4j's import directory"""
+        for label, rows in SAMPLE_NODES.items():
+            file_name = f"{label.lower()}s.csv"
+            with open(os.path.join(import_dir, file_name), "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+                writer.writeheader()
+                writer.writerows(rows)
+
+            # CALL ... IN TRANSACTIONS replaces USING PERIODIC COMMIT in Neo4j 5;
+            # it needs an auto-commit transaction, hence session.run
+            self.session.run(f"""
+                LOAD CSV WITH HEADERS FROM $url AS row
+                CALL {{
+                    WITH row
+                    MERGE (n:{label} {{name: row.name}})
+                    SET n += row
+                }} IN TRANSACTIONS OF 1000 ROWS
+            """, url=f"file:///{file_name}").consume()
+            print(f"✓ {label} nodes loaded from {file_name}")
+
+        self.create_relationships()
+
+    def create_relationships(self):
+        """Create all sample relationships"""
+        # Relationships touch nodes of every kind; one transaction avoids lock contention
+        with self.session.begin_transaction() as tx:
+            # Create relationships - Location
             location_rels = [
                 ("DB-Server", "Data-Center-1"),
                 ("Web-Server-1", "Data-Center-1"),
@@ -86,12 +130,12 @@ class GraphLoader:
                 ("Web-API", "Data-Center-1"),
                 ("Backup-Server", "Data-Center-2"),
             ]
-            for asset, location in location_rels:
-                session.run("""
-                    MATCH (a:Asset {name: $asset})
-                    MATCH (l:Location {name: $location})
-                    MERGE (a)-[:LOCATED_IN]->(l)
-                """, asset=asset, location=location)
+            tx.run("""
+                UNWIND $rows AS row
+                MATCH (a:Asset {name: row.asset})
+                MATCH (l:Location {name: row.location})
+                MERGE (a)-[:LOCATED_IN]->(l)
+            """, rows=[{"asset": asset, "location": location} for asset, location in location_rels])
             print("✓ Location relationships created")
 
             # Create dependencies
@@ -104,12 +148,13 @@ class GraphLoader:
                 ("Web-API", "Redis-Cache", "caching"),
                 ("DB-Server", "Backup-Server", "backup"),
             ]
-            for source, target, dep_type in dependencies:
-                session.run("""
-                    MATCH (s:Asset {name: $source})
-                    MATCH (t:Asset {name: $target})
-                    MERGE (s)-[:DEPENDS_ON {type: $type}]->(t)
-                """, source=source, target=target, type=dep_type)
+            tx.run("""
+                UNWIND $rows AS row
+                MATCH (s:Asset {name: row.source})
+                MATCH (t:Asset {name: row.target})
+                MERGE (s)-[:DEPENDS_ON {type: row.type}]->(t)
+            """, rows=[{"source": source, "target": target, "type": dep_type}
+                       for source, target, dep_type in dependencies])
             print("✓ Dependency relationships created")
 
             # Service to Asset mappings
@@ -118,12 +163,12 @@ class GraphLoader:
                 ("Payroll-Service", "Web-API"),
                 ("Email-Service", "Web-Server-1"),
             ]
-            for service, asset in service_mappings:
-                session.run("""
-                    MATCH (s:Service {name: $service})
-                    MATCH (a:Asset {name: $asset})
-                    MERGE (s)-[:RUNS_ON]->(a)
-                """, service=service, asset=asset)
+            tx.run("""
+                UNWIND $rows AS row
+                MATCH (s:Service {name: row.service})
+                MATCH (a:Asset {name: row.asset})
+                MERGE (s)-[:RUNS_ON]->(a)
+            """, rows=[{"service": service, "asset": asset} for service, asset in service_mappings])
             print("✓ Service-to-Asset relationships created")
 
             # User ownership
@@ -132,12 +177,12 @@ class GraphLoader:
                 ("John Smith", "Employee-Portal"),
                 ("Mike Davis", "Email-Service"),
             ]
-            for user, service in ownership:
-                session.run("""
-                    MATCH (u:User {name: $user})
-                    MATCH (s:Service {name: $service})
-                    MERGE (u)-[:OWNS]->(s)
-                """, user=user, service=service)
+            tx.run("""
+                UNWIND $rows AS row
+                MATCH (u:User {name: row.user})
+                MATCH (s:Service {name: row.service})
+                MERGE (u)-[:OWNS]->(s)
+            """, rows=[{"user": user, "service": service} for user, service in ownership])
             print("✓ User ownership relationships created")
 
             # User manages Assets
@@ -145,37 +190,65 @@ class GraphLoader:
                 ("John Smith", "DB-Server"),
                 ("Mike Davis", "Load-Balancer"),
             ]
-            for user, asset in manages:
-                session.run("""
-                    MATCH (u:User {name: $user})
-                    MATCH (a:Asset {name: $asset})
-                    MERGE (u)-[:MANAGES]->(a)
-                """, user=user, asset=asset)
+            tx.run("""
+                UNWIND $rows AS row
+                MATCH (u:User {name: row.user})
+                MATCH (a:Asset {name: row.asset})
+                MERGE (u)-[:MANAGES]->(a)
+            """, rows=[{"user": user, "asset": asset} for user, asset in manages])
             print("✓ User management relationships created")
 
+            # One commit (and one log flush) for all relationships
+            tx.commit()
+            print("✓ Relationships committed")
+
+    def _insert_nodes(self, label, rows):
+        """Merge all nodes of one label in a dedicated session and write transaction"""
+        # label comes from SAMPLE_NODES, never from user input
+        query = f"""
+            UNWIND $rows AS row
+            MERGE (n:{label} {{name: row.name}})
+            SET n += row
+        """
+        with self.driver.session() as session:
+            session.execute_write(lambda tx: tx.run(query, rows=rows).consume())
+        return label
+
     def print_stats(self):
         """Print graph statistics"""
-        with self.driver.session() as session:
-            result = session.run("""
+        queries = [
+            """
                 MATCH (n)
                 RETURN labels(n)[0] as label, count(*) as count
                 ORDER BY count DESC
-            """)
-            print("\n📊 Graph Statistics:")
-            for record in result:
-                print(f"  {record['label']}: {record['count']}")
-
-            result = session.run("""
+            """,
+            """
                 MATCH ()-[r]->()
                 RETURN type(r) as relType, count(*) as count
                 ORDER BY count DESC
-            """)
-            print("\n🔗 Relationship Statistics:")
-            for record in result:
-                print(f"  {record['relType']}: {record['count']}")
+            """,
+        ]
+        # The counts are independent; each execute_query borrows its own connection from the shared pool
+        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+            node_stats, rel_stats = executor.map(
+                lambda query: self.driver.execute_query(query, routing_=RoutingControl.READ).records, queries
+            )
+
+        print("\n📊 Graph Statistics:")
+        for record in node_stats:
+            print(f"  {record['label']}: {record['count']}")
+
+        print("\n🔗 Relationship Statistics:")
+        for record in rel_stats:
+            print(f"  {record['relType']}: {record['count']}")
 
 
 def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--csv", action="store_true",
+                        help=f"Bulk-load nodes with LOAD CSV via {NEO4J_IMPORT_DIR} (Neo4j's import directory)")
+    args = parser.parse_args()
+
     print("🚀 Loading CMDB Graph into Neo4j...\n")
 
     loader = GraphLoader(NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD)
@@ -183,7 +256,10 @@ def main():
     try:
         loader.clear_database()
         loader.create_constraints()
-        loader.load_sample_data()
+        if args.csv:
+            loader.bulk_load_csv(NEO4J_IMPORT_DIR)
+        else:
+            loader.load_sample_data()
         loader.print_stats()
         print("\n✅ Graph loaded successfully!")
     finally:
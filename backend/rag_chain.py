@@ -1,83 +1,96 @@
 """
-rag_chain.py - LangGraph-based RAG chain for CMDB question answering
+rag_chain.py - RAG chain for CMDB question answering
 Orchestrates: Question -> Retrieve -> Generate Answer
 """
 import os
+import re
+import asyncio
+from hashlib import blake2b
 from typing import TypedDict, Annotated
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage, SystemMessage
-from langgraph.graph import StateGraph, END
+from langchain_core.messages import HumanMessage
+from cachetools import TTLCache
 from graph_retriever_local import GraphRetriever
 from simple_llm import generate_answer
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 USE_SIMPLE_LLM = os.getenv("USE_SIMPLE_LLM", "false").lower() == "true"
 
+SYSTEM_PROMPT = """You are a helpful CMDB (Configuration Management Database) assistant.
+You have access to a knowledge graph containing information about IT assets, services, users, and their relationships.
+
+Your task is to answer questions based on the provided graph context. Be specific and reference the entities and relationships mentioned in the context.
+
+If the context doesn't contain enough information to answer the question, say so clearly.
+
+Keep your answers concise and factual."""
+
+USER_PROMPT_TEMPLATE = """Graph Context:
+{context}
+
+Question: {question}
+
+Please provide a clear, concise answer based on the graph context above."""
+
+# Questions about "now" must always be answered fresh
+TIME_SENSITIVE_PATTERN = re.compile(r"\b(now|current|currently|today|latest|recent|recently)\b", re.IGNORECASE)
+
+# System instructions are sent as part of the first (only) user turn
+FIRST_TURN_TEMPLATE = SYSTEM_PROMPT + "\n\n" + USER_PROMPT_TEMPLATE
+
 
 class GraphState(TypedDict):
-    """State that flows through the graph"""
+    """State that flows through the chain"""
     question: str
     retrieval_result: dict
     context: str
     answer: str
+    fallback: bool
     error: str | None
 
 
 class CMDBRagChain:
-    """RAG Chain for CMDB question answering using LangGraph"""
+    """RAG Chain for CMDB question answering (retrieve -> generate)"""
 
     def __init__(self, model_name: str = "gemini-pro"):
         self.retriever = GraphRetriever()
         self.llm = ChatGoogleGenerativeAI(
             model=model_name,
             temperature=0,
-            google_api_key=GOOGLE_API_KEY,
-            convert_system_message_to_human=True  # Gemini doesn't support SystemMessage
+            google_api_key=GOOGLE_API_KEY
         )
-        self.graph = self._build_graph()
-
-    def _build_graph(self) -> StateGraph:
-        """Build the LangGraph workflow"""
-        workflow = StateGraph(GraphState)
-
-        # Add nodes
-        workflow.add_node("retrieve", self._retrieve_node)
-        workflow.add_node("generate", self._generate_node)
+        # Answers are deterministic (temperature=0, static graph), so repeats are memoized
+        self._answer_cache = TTLCache(maxsize=512, ttl=300)
 
-        # Add edges
-        workflow.set_entry_point("retrieve")
-        workflow.add_edge("retrieve", "generate")
-        workflow.add_edge("generate", END)
+    async def start(self):
+        """Verify the retriever's dependencies and warm them up before serving questions"""
+        await self.retriever.check_vector_index()
+        # Pay embedding-model and index cold-start costs here, not on the first request
+        await self.retriever.retrieve("warmup", k=1)
 
-        return workflow.compile()
-
-    def _retrieve_node(self, state: GraphState) -> GraphState:
-        """Retrieve relevant graph context"""
+    async def _retrieve_node(self, state: GraphState) -> dict:
+        """Retrieve relevant graph context (returns only the updated state keys)"""
         question = state["question"]
 
         try:
             # Perform vector similarity search + expand to neighbors
-            retrieval_result = self.retriever.retrieve(question, k=5)
+            retrieval_result = await self.retriever.retrieve(question, k=5)
 
             # Format as text context
             context = self.retriever.format_context(retrieval_result)
 
             return {
-                **state,
                 "retrieval_result": retrieval_result,
                 "context": context,
                 "error": None
             }
         except Exception as e:
-            return {
-                **state,
-                "error": f"Retrieval error: {str(e)}"
-            }
+            return {"error": f"Retrieval error: {str(e)}"}
 
-    def _generate_node(self, state: GraphState) -> GraphState:
-        """Generate answer using LLM or simple fallback"""
+    async def _generate_node(self, state: GraphState) -> dict:
+        """Generate answer using LLM or simple fallback (returns only the updated state keys)"""
         if state.get("error"):
-            return state
+            return {}
 
         question = state["question"]
         context = state["context"]
@@ -86,53 +99,51 @@ class CMDBRagChain:
             # Use simple LLM fallback if enabled or if Gemini fails
             if USE_SIMPLE_LLM:
                 answer = generate_answer(question, context)
-                return {
-                    **state,
-                    "answer": answer,
-                    "error": None
-                }
+                return {"answer": answer, "error": None}
 
             # Try Gemini API
-            system_prompt = """You are a helpful CMDB (Configuration Management Database) assistant.
-You have access to a knowledge graph containing information about IT assets, services, users, and their relationships.
-
-Your task is to answer questions based on the provided graph context. Be specific and reference the entities and relationships mentioned in the context.
-
-If the context doesn't contain enough information to answer the question, say so clearly.
-
-Keep your answers concise and factual."""
-
-            user_prompt = f"""Graph Context:
-{context}
-
-Question: {question}
-
-Please provide a clear, concise answer based on the graph context above."""
-
-            messages = [
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=user_prompt)
-            ]
-
-            response = self.llm.invoke(messages)
+            response = await self.llm.ainvoke(self._build_messages(question, context))
             answer = response.content
 
-            return {
-                **state,
-                "answer": answer,
-                "error": None
-            }
+            return {"answer": answer, "error": None}
         except Exception as e:
             # Fallback to simple LLM on error
             print(f"Gemini API failed, using simple fallback: {str(e)}")
             answer = generate_answer(question, context)
-            return {
-                **state,
-                "answer": answer,
-                "error": None
+            return {"answer": answer, "fallback": True, "error": None}
+
+    @staticmethod
+    def _cache_key(question: str) -> bytes:
+        """Hash a normalized question for the answer cache"""
+        return blake2b(question.strip().lower().encode(), digest_size=16).digest()
+
+    def clear_cache(self) -> int:
+        """Drop all cached answers, returning how many were cached"""
+        cleared = len(self._answer_cache)
+        self._answer_cache.clear()
+        return cleared
+
+    @staticmethod
+    def _build_messages(question: str, context: str) -> list:
+        """Build the chat messages for a question and its graph context"""
+        prompt = FIRST_TURN_TEMPLATE.format(context=context, question=question)
+        return [HumanMessage(content=prompt)]
+
+    @staticmethod
+    def _extract_sources(retrieval_result: dict) -> list:
+        """Build source info for the similar nodes (not neighbors) of a retrieval result"""
+        # Only include similar nodes, not neighbors (which have a score of 0)
+        return [
+            {
+                "name": node["properties"].get("name", "Unknown"),
+                "type": node["label_str"],
+                "properties": node["properties"]
             }
+            for node in retrieval_result.get("nodes", [])
+            if node["score"] > 0
+        ]
 
-    def answer(self, question: str) -> dict:
+    async def answer(self, question: str) -> dict:
         """
         Answer a question using RAG over the graph
 
@@ -142,17 +153,25 @@ Please provide a clear, concise answer based on the graph context above."""
         Returns:
             Dictionary with answer, sources, and metadata
         """
+        cache_key = self._cache_key(question)
+        cached = self._answer_cache.get(cache_key)
+        if cached is not None:
+            return {**cached, "question": question}
+
         # Initialize state
-        initial_state = {
+        state: GraphState = {
             "question": question,
             "retrieval_result": {},
             "context": "",
             "answer": "",
+            "fallback": False,
             "error": None
         }
 
-        # Run the graph
-        final_state = self.graph.invoke(initial_state)
+        # Run the two steps directly; each returns only the keys it updates
+        state.update(await self._retrieve_node(state))
+        state.update(await self._generate_node(state))
+        final_state = state
 
         # Check for errors
         if final_state.get("error"):
@@ -166,19 +185,7 @@ Please provide a clear, concise answer based on the graph context above."""
 
         # Extract sources from retrieval result
         retrieval_result = final_state.get("retrieval_result", {})
-        nodes = retrieval_result.get("nodes", [])
-
-        sources = []
-        for node in nodes:
-            if node.get("score", 0) > 0:  # Only include similar nodes, not neighbors
-                labels = ":".join(node["labels"])
-                props = node["properties"]
-                name = props.get("name", "Unknown")
-                sources.append({
-                    "name": name,
-                    "type": labels,
-                    "properties": props
-                })
+        sources = self._extract_sources(retrieval_result)
 
         result = {
             "question": question,
@@ -192,20 +199,70 @@ Please provide a clear, concise answer based on the graph context above."""
         print(f"DEBUG - Final result keys: {result.keys()}")
         print(f"DEBUG - graph_data type: {type(result['graph_data'])}")
 
+        # Degraded fallback answers are not cached, so Gemini is retried on the next ask
+        if not final_state["fallback"] and not TIME_SENSITIVE_PATTERN.search(question):
+            self._answer_cache[cache_key] = result
+
         return result
 
-    def close(self):
+    async def stream_answer(self, question: str):
+        """
+        Answer a question, yielding events as soon as they are available
+
+        Args:
+            question: User's question
+
+        Yields:
+            A "context" event with sources and graph data once retrieval finishes,
+            "token" events as the answer is generated, then a final "done" event
+            (or a single "error" event if retrieval fails)
+        """
+        retrieved = await self._retrieve_node({"question": question})
+        if retrieved.get("error"):
+            yield {"type": "error", "error": retrieved["error"]}
+            return
+
+        retrieval_result = retrieved["retrieval_result"]
+        context = retrieved["context"]
+        yield {
+            "type": "context",
+            "sources": self._extract_sources(retrieval_result),
+            "graph_data": retrieval_result
+        }
+
+        if USE_SIMPLE_LLM:
+            yield {"type": "token", "content": generate_answer(question, context)}
+        else:
+            streamed = False
+            try:
+                async for chunk in self.llm.astream(self._build_messages(question, context)):
+                    if chunk.content:
+                        streamed = True
+                        yield {"type": "token", "content": chunk.content}
+            except Exception as e:
+                if streamed:
+                    yield {"type": "error", "error": f"Generation error: {str(e)}"}
+                    return
+                # Fallback to simple LLM if Gemini fails before producing any tokens
+                print(f"Gemini API failed, using simple fallback: {str(e)}")
+                yield {"type": "token", "content": generate_answer(question, context)}
+
+        yield {"type": "done"}
+
+    async def close(self):
         """Clean up resources"""
-        self.retriever.close()
+        await self.retriever.close()
 
 
-def test_chain():
+async def test_chain():
     """Test the RAG chain with sample questions"""
     print("🤖 Testing CMDB RAG Chain\n")
 
     chain = CMDBRagChain()
 
     try:
+        await chain.start()
+
         test_questions = [
             "Where is the DB-Server located?",
             "What assets will break if Web-API goes down?",
@@ -216,7 +273,7 @@ def test_chain():
 
         for question in test_questions:
             print(f"\n❓ Question: {question}")
-            result = chain.answer(question)
+            result = await chain.answer(question)
 
             print(f"\n💬 Answer: {result['answer']}")
 
@@ -228,8 +285,8 @@ def test_chain():
             print("\n" + "=" * 80)
 
     finally:
-        chain.close()
+        await chain.close()
 
 
 if __name__ == "__main__":
-    test_chain()
+    asyncio.run(test_chain())
@@ -2,6 +2,60 @@
 simple_llm.py - Simple rule-based LLM fallback (no API needed)
 Generates answers based on graph context without external API calls
 """
+import re
+from itertools import islice
+
+# Literal keywords for each relation category the rules look for
+_LOCATION_LINE = ("LOCATED_IN", "Location")
+_DEPENDENCY_LINE = ("DEPENDS_ON",)
+_OWNERSHIP_LINE = ("OWNS", "User")
+_SERVICE_LINE = ("Service", "RUNS_ON")
+
+
+def _matching_lines(context, keywords):
+    """Lazily yield stripped context lines containing any of a category's keywords"""
+    # One substring scan over the whole context skips line splitting when nothing can match
+    keywords = [keyword for keyword in keywords if keyword in context]
+    if not keywords:
+        return iter(())
+    return (line.strip() for line in context.split('\n') if any(keyword in line for keyword in keywords))
+
+
+def _answer_location(context):
+    """First line mentioning a location"""
+    line = next(_matching_lines(context, _LOCATION_LINE), None)
+    if line is not None:
+        return f"Based on the graph data: {line}"
+
+
+def _answer_dependency(context):
+    """All dependency lines"""
+    deps = list(_matching_lines(context, _DEPENDENCY_LINE))
+    if deps:
+        return f"Based on the dependency graph:\n" + "\n".join(deps)
+
+
+def _answer_ownership(context):
+    """First line mentioning ownership"""
+    line = next(_matching_lines(context, _OWNERSHIP_LINE), None)
+    if line is not None:
+        return f"Based on the ownership data: {line}"
+
+
+def _answer_service(context):
+    """Up to five service / RUNS_ON lines"""
+    services = list(islice(_matching_lines(context, _SERVICE_LINE), 5))
+    if services:
+        return "Based on the graph:\n" + "\n".join(services)
+
+
+# Question intents, checked in order; only the first matching intent is tried
+_INTENTS = [
+    (re.compile(r"locat(?:ed|ion)", re.IGNORECASE), _answer_location),
+    (re.compile(r"break|depend|down", re.IGNORECASE), _answer_dependency),
+    (re.compile(r"own", re.IGNORECASE), _answer_ownership),
+    (re.compile(r"^(?=.*service)(?=.*running)", re.IGNORECASE | re.DOTALL), _answer_service),
+]
 
 
 def generate_answer(question: str, context: str) -> str:
@@ -9,35 +63,20 @@ def generate_answer(question: str, context: str) -> str:
     Generate a simple answer based on the graph context
     This is a fallback that doesn't require any LLM API
     """
-    question_lower = question.lower()
-
-    # Extract key information from context
-    lines = context.split('\n')
-
-    # Simple pattern matching for common questions
-    if 'located' in question_lower or 'location' in question_lower:
-        for line in lines:
-            if 'LOCATED_IN' in line or 'Location' in line:
-                return f"Based on the graph data: {line.strip()}"
-
-    elif 'break' in question_lower or 'depend' in question_lower or 'down' in question_lower:
-        deps = [line.strip() for line in lines if 'DEPENDS_ON' in line]
-        if deps:
-            return f"Based on the dependency graph:\n" + "\n".join(deps)
-
-    elif 'own' in question_lower:
-        for line in lines:
-            if 'OWNS' in line or 'User' in line:
-                return f"Based on the ownership data: {line.strip()}"
-
-    elif 'service' in question_lower and 'running' in question_lower:
-        services = [line.strip() for line in lines if 'Service' in line or 'RUNS_ON' in line]
-        if services:
-            return "Based on the graph:\n" + "\n".join(services[:5])
-
-    # Generic response using all relevant information
-    relevant_lines = [line.strip() for line in lines if line.strip() and not line.startswith('#')]
+    # Dispatch to the first matching intent; fall through to the generic answer if it finds nothing
+    for pattern, handler in _INTENTS:
+        if pattern.search(question):
+            answer = handler(context)
+            if answer:
+                return answer
+            break
+
+    # Generic response using the first relevant lines
+    relevant_lines = list(islice(
+        (line.strip() for line in context.split('\n') if line.strip() and not line.startswith('#')),
+        10
+    ))
     if relevant_lines:
-        return "Based on the CMDB graph data:\n\n" + "\n".join(relevant_lines[:10])
+        return "Based on the CMDB graph data:\n\n" + "\n".join(relevant_lines)
 
     return "I found some information in the graph. Please check the visualization on the right for details."